@@ -1,25 +1,111 @@
+import gzip
+import hashlib
+import hmac
+import mimetypes
 import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timezone
+from pathlib import Path
+from typing import Annotated
 
-from fastapi import FastAPI, HTTPException, Header, Request, Depends
+import orjson
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import AwareDatetime, BaseModel, Field, StringConstraints
 
 PRICE_PER_LITER = 12.0
+# Pengar lagras som heltal i öre
+PRICE_ORE_PER_LITER = round(PRICE_PER_LITER * 100)
 
 # Local: ./fuel.db
 # Azure persistent: /home/fuel.db
 DB_PATH = os.getenv("DB_PATH", "./fuel.db")
 
+# Read-only connections kept open next to the single writer
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_STATEMENT_CACHE_SIZE = 512
+
 # set in Azure Configuration (no default recommended in prod)
 APP_PASSWORD = os.getenv("APP_PASSWORD")
+APP_PASSWORD_BYTES = APP_PASSWORD.encode() if APP_PASSWORD else None
+
+# Worker threads for the sync (def) endpoints; anyio defaults to 40
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "200"))
+
+STATIC_DIR = Path("static")
 
 CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
 
-app = FastAPI(title="Fuel Friends")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    init_db()
+    open_db()
+    load_static()
+    try:
+        yield
+    finally:
+        close_db()
+
+app = FastAPI(title="Fuel Friends", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# ---------- GZIP ----------
+class GZipApi:
+    """GZip bara för /api/ (JSON); static/ har egna gzip-kopior och bilder är redan komprimerade"""
 
+    def __init__(self, app):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=512, compresslevel=4)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/api/"):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+# Registreras först = innersta lagret, så det ser hela svarskroppar (minimum_size gäller)
+app.add_middleware(GZipApi)
+
+# ---------- AUTH ----------
+def password_matches(password: str | None) -> bool:
+    # compare_digest: jämförelsen tar lika lång tid oavsett var strängarna skiljer sig
+    return hmac.compare_digest((password or "").encode(), APP_PASSWORD_BYTES)
+
+class RequirePassword:
+    """En kontroll för hela /api/ (utom login) innan routingen, i stället för Depends på varje route
+
+    Ren ASGI: ingen task group eller memory stream per request som med @app.middleware("http").
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            if path.startswith("/api/") and path != "/api/login":
+                error = None
+                if not APP_PASSWORD_BYTES:
+                    error = ORJSONResponse({"detail": "APP_PASSWORD is not configured in Azure"}, status_code=500)
+                else:
+                    password = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"x-app-password"), None)
+                    if not password_matches(password):
+                        error = ORJSONResponse({"detail": "Unauthorized"}, status_code=401)
+                if error is not None:
+                    await error(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequirePassword)
+
+# Added after the auth middleware so CORS wraps it (preflights and 401s get CORS headers)
 if CORS_ORIGINS:
     app.add_middleware(
         CORSMiddleware,
@@ -29,51 +115,118 @@ if CORS_ORIGINS:
         allow_headers=["*"],
     )
 
-# ---------- AUTH ----------
-def require_password(x_app_password: str | None = Header(default=None, alias="X-App-Password")):
-    if not APP_PASSWORD:
-        raise HTTPException(status_code=500, detail="APP_PASSWORD is not configured in Azure")
-    if x_app_password != APP_PASSWORD:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
 @app.post("/api/login")
 async def login(req: Request):
-    body = await req.json()
+    body = orjson.loads(await req.body())
     password = (body.get("password") or "").strip()
 
-    if not APP_PASSWORD:
+    if not APP_PASSWORD_BYTES:
         raise HTTPException(status_code=500, detail="APP_PASSWORD is not configured in Azure")
 
-    if password != APP_PASSWORD:
+    if not password_matches(password):
         raise HTTPException(status_code=401, detail="Fel lösenord")
 
     return {"ok": True}
 
 # ---------- DB ----------
-def connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# WAL lets readers run alongside the writer; synchronous=NORMAL only fsyncs at checkpoints
+DB_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA cache_size=-64000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA foreign_keys=ON;
+"""
+
+def connect(readonly: bool = False):
+    # Connections live for the whole process, so a roomy statement cache keeps every query prepared
+    opts = {"check_same_thread": False, "isolation_level": None, "cached_statements": DB_STATEMENT_CACHE_SIZE}
+    if readonly:
+        uri = f"{Path(DB_PATH).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, **opts)
+    else:
+        conn = sqlite3.connect(DB_PATH, **opts)
     conn.row_factory = sqlite3.Row
+    conn.executescript(DB_PRAGMAS)
     return conn
 
+def open_db():
+    """Öppna den delade skrivanslutningen och poolen med läsanslutningar"""
+    app.state.db = connect()
+    app.state.db_lock = threading.Lock()
+    # Bumpas vid varje lyckad skrivning; används som ETag för vänlistan
+    app.state.friends_version = 0
+    app.state.boot_id = os.urandom(4).hex()  # ny ETag-serie efter omstart
+    app.state.friends_cache = None  # (etag, färdig JSON) för senaste vänlistan
+    app.state.readers = queue.Queue()
+    for _ in range(DB_READ_POOL_SIZE):
+        app.state.readers.put(connect(readonly=True))
+
+def close_db():
+    while not app.state.readers.empty():
+        app.state.readers.get_nowait().close()
+    app.state.db.execute("PRAGMA optimize")
+    app.state.db.close()
+
+@contextmanager
+def db_reader():
+    # Blockerande (kö + sqlite3): används bara från trådpoolen, aldrig direkt på event-loopen
+    conn = app.state.readers.get()
+    try:
+        yield conn
+    finally:
+        app.state.readers.put(conn)
+
+@contextmanager
+def db_writer():
+    """Kör allt i blocket som en enda skrivtransaktion (en commit, en fsync)"""
+    # FastAPI runs def-endpoints in a threadpool; sqlite allows one writer at a time
+    with app.state.db_lock:
+        conn = app.state.db
+        # `with conn` commits on success and rolls back on any exception (also HTTPException)
+        with conn:
+            # IMMEDIATE takes the write lock up front instead of upgrading mid-transaction
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+        app.state.friends_version += 1
+
 def init_db():
     conn = connect()
     cur = conn.cursor()
+    # Schema + migreringar körs som en transaktion
+    cur.execute("BEGIN IMMEDIATE")
 
+    # balance_ore = kvar att betala (negativt = överskott), paid_ore = betalt totalt
     cur.execute("""
         CREATE TABLE IF NOT EXISTS friends (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
-            total_liters REAL NOT NULL DEFAULT 0,
-            paid_sek REAL NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL
+            balance_ore INTEGER NOT NULL DEFAULT 0,
+            paid_ore INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            balance_sek REAL GENERATED ALWAYS AS (balance_ore / 100.0) VIRTUAL
         )
     """)
 
-    # Upgrade old DBs (if paid_sek missing)
-    try:
-        cur.execute("ALTER TABLE friends ADD COLUMN paid_sek REAL NOT NULL DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
+    # Upgrade old DBs (REAL liters/kronor -> heltal öre)
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(friends)")}
+    if "balance_ore" not in cols:
+        cur.execute("ALTER TABLE friends ADD COLUMN balance_ore INTEGER NOT NULL DEFAULT 0")
+        cur.execute("ALTER TABLE friends ADD COLUMN paid_ore INTEGER NOT NULL DEFAULT 0")
+        cur.execute(
+            "UPDATE friends SET balance_ore = CAST(round(total_liters * ?) AS INTEGER)",
+            (PRICE_ORE_PER_LITER,)
+        )
+        cur.execute("ALTER TABLE friends DROP COLUMN total_liters")
+        if "paid_sek" in cols:
+            cur.execute("UPDATE friends SET paid_ore = CAST(round(paid_sek * 100) AS INTEGER)")
+            cur.execute("ALTER TABLE friends DROP COLUMN paid_sek")
+
+    # Upgrade old DBs (generated kronor-kolumn; table_info visar inte genererade kolumner)
+    if "balance_sek" not in {r["name"] for r in cur.execute("PRAGMA table_xinfo(friends)")}:
+        cur.execute("ALTER TABLE friends ADD COLUMN balance_sek REAL GENERATED ALWAYS AS (balance_ore / 100.0) VIRTUAL")
 
     # Transaktionslogg
     cur.execute("""
@@ -83,283 +236,369 @@ def init_db():
             type TEXT NOT NULL,
             amount REAL NOT NULL,
             description TEXT NOT NULL,
-            created_at TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
             FOREIGN KEY (friend_id) REFERENCES friends(id) ON DELETE CASCADE
         )
     """)
 
+    # Upgrade old DBs (created_at TEXT ISO -> INTEGER epoch-ms)
+    for table in ("friends", "transactions"):
+        types = {r["name"]: r["type"] for r in cur.execute(f"PRAGMA table_info({table})")}
+        if types["created_at"] == "TEXT":
+            cur.execute("DROP INDEX IF EXISTS idx_tx_friend_created")
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN created_ms INTEGER NOT NULL DEFAULT 0")
+            cur.execute(
+                f"UPDATE {table} SET created_ms = CAST(round((julianday(created_at) - 2440587.5) * 86400000) AS INTEGER)"
+            )
+            cur.execute(f"ALTER TABLE {table} DROP COLUMN created_at")
+            cur.execute(f"ALTER TABLE {table} RENAME COLUMN created_ms TO created_at")
+
+    # Matchar get_transactions: WHERE friend_id = ? ORDER BY created_at DESC LIMIT 50
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_friend_created ON transactions(friend_id, created_at DESC)")
+
     conn.commit()
+    # Låt SQLite uppdatera planerarens statistik där det behövs (billigt när inget ändrats)
+    conn.execute("PRAGMA optimize")
     conn.close()
 
-@app.on_event("startup")
-def startup():
-    init_db()
-
-def now_utc_iso():
-    return datetime.now(timezone.utc).isoformat()
-
-def calc_total_sek(liters: float) -> float:
-    return round(float(liters) * PRICE_PER_LITER, 2)
-
-def clean_name(name: str) -> str:
-    return name.strip()
+# ---------- SQL ----------
+# Samma strängobjekt varje gång, så sqlite3:s statement-cache träffar direkt
+SQL_INSERT_TRANSACTION = "INSERT INTO transactions (friend_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?)"
+SQL_LIST_FRIENDS = "SELECT id, name, balance_ore, balance_sek, paid_ore FROM friends ORDER BY id ASC"
+SQL_FRIEND_EXISTS = "SELECT id FROM friends WHERE id = ?"
+SQL_INSERT_FRIEND = "INSERT INTO friends (name, created_at) VALUES (?, ?)"
+SQL_RENAME_FRIEND = "UPDATE friends SET name = ? WHERE id = ? RETURNING balance_ore, paid_ore"
+SQL_DELETE_FRIEND = "DELETE FROM friends WHERE id = ? RETURNING id"
+SQL_ADD_LITERS = "UPDATE friends SET balance_ore = balance_ore + ? WHERE id = ? RETURNING name, balance_ore, paid_ore"
+SQL_ADD_LITERS_BULK = "UPDATE friends SET balance_ore = balance_ore + ? WHERE id = ?"
+# Tillåt överbetalning - saldot kan bli negativt (= överskott)
+SQL_PAY = """
+    UPDATE friends SET balance_ore = balance_ore - ?, paid_ore = paid_ore + ?
+    WHERE id = ?
+    RETURNING name, balance_ore, paid_ore
+"""
+SQL_RESET_FRIEND = "UPDATE friends SET balance_ore = 0, paid_ore = 0 WHERE id = ? RETURNING name"
+SQL_RESET_ALL = "UPDATE friends SET balance_ore = 0, paid_ore = 0 RETURNING id"
+SQL_LIST_TRANSACTIONS = """
+    SELECT id, type, amount, description, created_at
+    FROM transactions
+    WHERE friend_id = ?
+    ORDER BY created_at DESC
+    LIMIT 50
+"""
+
+# Förbundna en gång: sparar attributuppslagningar i varje anrop
+_time_ns = time.time_ns
+_fromtimestamp = datetime.fromtimestamp
+_UTC = timezone.utc
+
+def now_ms() -> int:
+    """Tidpunkt som lagras i databasen: millisekunder sedan epoch (UTC)"""
+    return _time_ns() // 1_000_000
+
+def ms_to_iso(ms: int) -> str:
+    return _fromtimestamp(ms / 1000, _UTC).isoformat(timespec="milliseconds")
+
+def liters_to_ore(liters: float) -> int:
+    return round(liters * PRICE_ORE_PER_LITER)
+
+def sek_to_ore(sek: float) -> int:
+    return round(sek * 100)
+
+def friend_json(id: int, name: str, balance_ore: int, paid_ore: int) -> dict:
+    # saldot = KVAR, så remainingSek är samma som totalSek
+    return {
+        "id": id,
+        "name": name,
+        "totalLiters": round(balance_ore / PRICE_ORE_PER_LITER, 2),
+        "totalSek": balance_ore / 100,
+        "paidSek": paid_ore / 100,
+        "remainingSek": balance_ore / 100,
+    }
 
 def round2(x: float) -> float:
     return round(float(x), 2)
 
 def log_transaction(conn, friend_id: int, trans_type: str, amount: float, description: str):
-    """Logga en transaktion till databasen"""
+    """Logga en transaktion i anroparens pågående transaktion (ingen egen commit)"""
     cur = conn.cursor()
     cur.execute(
-        "INSERT INTO transactions (friend_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
-        (friend_id, trans_type, amount, description, now_utc_iso())
+        SQL_INSERT_TRANSACTION,
+        (friend_id, trans_type, amount, description, now_ms())
     )
-    conn.commit()
+
+def log_transactions_bulk(conn, rows):
+    """Logga många transaktioner med en executemany i anroparens pågående transaktion
+
+    rows: (friend_id, type, amount, description, created_at_ms)
+    """
+    conn.executemany(SQL_INSERT_TRANSACTION, rows)
 
 # ---------- MODELS ----------
+# Trimmas och längdkontrolleras av pydantic-core innan endpointen anropas
+StrippedName = Annotated[str, StringConstraints(strip_whitespace=True, min_length=2)]
+
 class FriendCreate(BaseModel):
-    name: str = Field(min_length=2)
+    name: StrippedName
 
 class FriendUpdate(BaseModel):
-    name: str = Field(min_length=2)
+    name: StrippedName
 
 class AddLitersBody(BaseModel):
     liters: float = Field(gt=0)
 
+class BulkAddLitersItem(BaseModel):
+    id: int
+    liters: float = Field(gt=0)
+
+class BulkAddLitersBody(BaseModel):
+    items: list[BulkAddLitersItem] = Field(min_length=1)
+
 class PayBody(BaseModel):
     amount: float = Field(gt=0)
 
-# ---------- API (protected) ----------
-@app.get("/api/friends", dependencies=[Depends(require_password)])
-def list_friends():
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, total_liters, paid_sek, created_at FROM friends ORDER BY id ASC")
-    rows = cur.fetchall()
-    conn.close()
+class TransactionImport(BaseModel):
+    friend_id: int
+    type: str = Field(min_length=1)
+    amount: float
+    description: str
+    created_at: AwareDatetime
 
-    out = []
-    for r in rows:
-        liters = float(r["total_liters"])  # KVAR liters
-        total_sek = calc_total_sek(liters)  # KVAR summa
-        paid = float(r["paid_sek"])
-
-        out.append({
-            "id": int(r["id"]),
-            "name": r["name"],
-            "totalLiters": round2(liters),
-            "totalSek": round2(total_sek),
-            "paidSek": round2(paid),
-            "remainingSek": round2(total_sek),  # samma som totalSek eftersom liters = kvar
-        })
-    return out
-
-@app.post("/api/friends", status_code=201, dependencies=[Depends(require_password)])
+# ---------- API (protected) ----------
+def friends_etag() -> str:
+    # Svag ETag: gzip- och okomprimerad variant delar samma tagg
+    return f'W/"{app.state.boot_id}-{app.state.friends_version}"'
+
+def friends_json_bytes() -> bytes:
+    price = PRICE_ORE_PER_LITER  # lokal variabel: ingen global uppslagning per rad
+    with db_reader() as conn:
+        cur = conn.cursor()
+        cur.row_factory = None  # tupler räcker här och är snabbare än sqlite3.Row
+        cur.execute(SQL_LIST_FRIENDS)
+
+        # Samma form som friend_json, inlinad för att slippa ett funktionsanrop per rad
+        return orjson.dumps([
+            {
+                "id": fid,
+                "name": name,
+                "totalLiters": round(balance / price, 2),
+                "totalSek": balance_sek,
+                "paidSek": paid / 100,
+                "remainingSek": balance_sek,
+            }
+            for fid, name, balance, balance_sek, paid in cur
+        ])
+
+@app.get("/api/friends")
+async def list_friends(request: Request):
+    # Läs versionen före frågan så att en samtidig skrivning aldrig ger en för ny ETag
+    etag = friends_etag()
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    # Varje skrivning bumpar versionen, så en cache med samma ETag är alltid aktuell
+    cached = app.state.friends_cache
+    if cached is not None and cached[0] == etag:
+        return Response(cached[1], media_type="application/json", headers=headers)
+
+    # Bara cache-missar behöver databasen; frågan körs i trådpoolen så loopen aldrig blockeras
+    body = await to_thread.run_sync(friends_json_bytes)
+    app.state.friends_cache = (etag, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.post("/api/friends", status_code=201)
 def create_friend(body: FriendCreate):
-    name = clean_name(body.name)
-    if len(name) < 2:
-        raise HTTPException(status_code=400, detail="Name must be at least 2 characters.")
+    name = body.name
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO friends (name, total_liters, paid_sek, created_at) VALUES (?, ?, ?, ?)",
-        (name, 0.0, 0.0, now_utc_iso())
-    )
-    conn.commit()
-    new_id = cur.lastrowid
-    
-    # Logga skapande
-    log_transaction(conn, new_id, "created", 0.0, f"Skapade kontakt: {name}")
-    
-    conn.close()
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_INSERT_FRIEND, (name, now_ms()))
+        new_id = cur.lastrowid
 
-    return {"id": new_id, "name": name, "totalLiters": 0.0, "totalSek": 0.0, "paidSek": 0.0, "remainingSek": 0.0}
+        # Logga skapande
+        log_transaction(conn, new_id, "created", 0.0, f"Skapade kontakt: {name}")
 
-@app.put("/api/friends/{id}", dependencies=[Depends(require_password)])
-def rename_friend(id: int, body: FriendUpdate):
-    name = clean_name(body.name)
-    if len(name) < 2:
-        raise HTTPException(status_code=400, detail="Name must be at least 2 characters.")
+    return friend_json(new_id, name, 0, 0)
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, total_liters, paid_sek FROM friends WHERE id = ?", (id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Friend not found.")
-
-    cur.execute("UPDATE friends SET name = ? WHERE id = ?", (name, id))
-    conn.commit()
-    conn.close()
+@app.put("/api/friends/{id}")
+def rename_friend(id: int, body: FriendUpdate):
+    name = body.name
 
-    liters = float(row["total_liters"])
-    total_sek = calc_total_sek(liters)
-    paid = float(row["paid_sek"])
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_RENAME_FRIEND, (name, id))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Friend not found.")
 
-    return {
-        "id": id,
-        "name": name,
-        "totalLiters": round2(liters),
-        "totalSek": round2(total_sek),
-        "paidSek": round2(paid),
-        "remainingSek": round2(total_sek),
-    }
+    return friend_json(id, name, row["balance_ore"], row["paid_ore"])
 
-@app.delete("/api/friends/{id}", status_code=204, dependencies=[Depends(require_password)])
+@app.delete("/api/friends/{id}", status_code=204)
 def delete_friend(id: int):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM friends WHERE id = ?", (id,))
-    if not cur.fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="Friend not found.")
-
-    cur.execute("DELETE FROM friends WHERE id = ?", (id,))
-    conn.commit()
-    conn.close()
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_DELETE_FRIEND, (id,))
+        if not cur.fetchone():
+            raise HTTPException(status_code=404, detail="Friend not found.")
     return
 
-@app.post("/api/friends/{id}/add-liters", dependencies=[Depends(require_password)])
+@app.post("/api/friends/{id}/add-liters")
 def add_liters(id: int, body: AddLitersBody):
     liters_to_add = float(body.liters)
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, total_liters, paid_sek FROM friends WHERE id = ?", (id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Friend not found.")
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_ADD_LITERS, (liters_to_ore(liters_to_add), id))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Friend not found.")
 
-    new_liters = float(row["total_liters"]) + liters_to_add
-    cur.execute("UPDATE friends SET total_liters = ? WHERE id = ?", (new_liters, id))
-    
-    # Logga transaktion
-    log_transaction(conn, id, "add_liters", liters_to_add, f"Lade till {round2(liters_to_add)} L")
-    
-    conn.commit()
-    conn.close()
+        # Logga transaktion
+        log_transaction(conn, id, "add_liters", liters_to_add, f"Lade till {round2(liters_to_add)} L")
 
-    total_sek = calc_total_sek(new_liters)
-    paid = float(row["paid_sek"])
+    return friend_json(id, row["name"], row["balance_ore"], row["paid_ore"])
 
-    return {
-        "id": id,
-        "name": row["name"],
-        "totalLiters": round2(new_liters),
-        "totalSek": round2(total_sek),
-        "paidSek": round2(paid),
-        "remainingSek": round2(total_sek),
-    }
+@app.post("/api/friends/bulk-add-liters")
+def bulk_add_liters(body: BulkAddLitersBody):
+    items = body.items
 
-# ✅ NY LOGIK: betalt kan ge överskott (positiv balans)
-@app.post("/api/friends/{id}/pay", dependencies=[Depends(require_password)])
-def pay_friend(id: int, body: PayBody):
-    amount = float(body.amount)
-    liters_to_subtract = amount / PRICE_PER_LITER  # 100kr => 10L
+    # En transaktion (en fsync) för alla tankningar i stället för en request per vän
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.executemany(SQL_ADD_LITERS_BULK, [(liters_to_ore(i.liters), i.id) for i in items])
+        if cur.rowcount != len(items):
+            raise HTTPException(status_code=404, detail="Friend not found.")
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, total_liters, paid_sek FROM friends WHERE id = ?", (id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Friend not found.")
+        ts = now_ms()
+        log_transactions_bulk(conn, [
+            (i.id, "add_liters", i.liters, f"Lade till {round2(i.liters)} L", ts) for i in items
+        ])
 
-    current_liters = float(row["total_liters"])
-    current_paid = float(row["paid_sek"])
+    return {"ok": True, "updated": len(items)}
 
-    # Tillåt överbetalning - liters kan bli negativa (= överskott)
-    new_liters = current_liters - liters_to_subtract
-    new_paid = current_paid + amount
+# ✅ NY LOGIK: betalt kan ge överskott (positiv balans)
+@app.post("/api/friends/{id}/pay")
+def pay_friend(id: int, body: PayBody):
+    amount = float(body.amount)
+    amount_ore = sek_to_ore(amount)
 
-    cur.execute(
-        "UPDATE friends SET total_liters = ?, paid_sek = ? WHERE id = ?",
-        (new_liters, new_paid, id)
-    )
-    
-    # Logga betalning
-    log_transaction(conn, id, "payment", amount, f"Betalade {round2(amount)} kr")
-    
-    conn.commit()
-    conn.close()
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_PAY, (amount_ore, amount_ore, id))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Friend not found.")
 
-    total_sek = calc_total_sek(new_liters)  # Negativa liter = negativt saldo = överskott
+        # Logga betalning
+        log_transaction(conn, id, "payment", amount, f"Betalade {round2(amount)} kr")
 
-    return {
-        "id": id,
-        "name": row["name"],
-        "totalLiters": round2(new_liters),
-        "totalSek": round2(total_sek),
-        "paidSek": round2(new_paid),
-        "remainingSek": round2(total_sek),
-    }
+    return friend_json(id, row["name"], row["balance_ore"], row["paid_ore"])
 
-@app.post("/api/friends/{id}/reset", dependencies=[Depends(require_password)])
+@app.post("/api/friends/{id}/reset")
 def reset_friend(id: int):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name FROM friends WHERE id = ?", (id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Friend not found.")
+    with db_writer() as conn:
+        cur = conn.cursor()
+        # reset både saldo och betalt
+        cur.execute(SQL_RESET_FRIEND, (id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Friend not found.")
 
-    # reset både liters och betalt
-    cur.execute("UPDATE friends SET total_liters = 0, paid_sek = 0 WHERE id = ?", (id,))
-    
-    # Logga nollställning
-    log_transaction(conn, id, "reset", 0.0, "Nollställde kontot")
-    
-    conn.commit()
-    conn.close()
+        # Logga nollställning
+        log_transaction(conn, id, "reset", 0.0, "Nollställde kontot")
 
-    return {"id": id, "name": row["name"], "totalLiters": 0.0, "totalSek": 0.0, "paidSek": 0.0, "remainingSek": 0.0}
+    return friend_json(id, row["name"], 0, 0)
 
-@app.post("/api/reset-all", dependencies=[Depends(require_password)])
+@app.post("/api/reset-all")
 def reset_all():
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("UPDATE friends SET total_liters = 0, paid_sek = 0")
-    conn.commit()
-    conn.close()
+    with db_writer() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_RESET_ALL)
+        ids = cur.fetchall()
+
+        # Logga nollställning för alla i samma transaktion
+        ts = now_ms()
+        log_transactions_bulk(conn, [(fid, "reset", 0.0, "Nollställde alla konton", ts) for (fid,) in ids])
     return {"ok": True}
 
-@app.get("/api/friends/{id}/transactions", dependencies=[Depends(require_password)])
-def get_transactions(id: int):
-    conn = connect()
-    cur = conn.cursor()
-    
-    # Kontrollera att personen finns
-    cur.execute("SELECT id FROM friends WHERE id = ?", (id,))
-    if not cur.fetchone():
-        conn.close()
+@app.post("/api/transactions/import", status_code=201)
+def import_transactions(body: list[TransactionImport]):
+    rows = [
+        (t.friend_id, t.type, t.amount, t.description, int(t.created_at.timestamp() * 1000))
+        for t in body
+    ]
+    try:
+        with db_writer() as conn:
+            log_transactions_bulk(conn, rows)
+    except sqlite3.IntegrityError:
+        # foreign_keys=ON: okänt friend_id, hela importen rullas tillbaka
         raise HTTPException(status_code=404, detail="Friend not found.")
-    
-    # Hämta transaktioner
-    cur.execute("""
-        SELECT id, type, amount, description, created_at 
-        FROM transactions 
-        WHERE friend_id = ? 
-        ORDER BY created_at DESC
-        LIMIT 50
-    """, (id,))
-    rows = cur.fetchall()
-    conn.close()
-    
-    transactions = []
-    for r in rows:
-        transactions.append({
-            "id": int(r["id"]),
-            "type": r["type"],
-            "amount": round2(r["amount"]),
-            "description": r["description"],
-            "createdAt": r["created_at"]
-        })
-    
-    return transactions
-
-# Frontend (static/)
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
+    return {"ok": True, "imported": len(rows)}
+
+@app.get("/api/friends/{id}/transactions")
+def get_transactions(id: int):
+    with db_reader() as conn:
+        cur = conn.cursor()
+        cur.row_factory = None
+
+        # Kontrollera att personen finns
+        cur.execute(SQL_FRIEND_EXISTS, (id,))
+        if not cur.fetchone():
+            raise HTTPException(status_code=404, detail="Friend not found.")
+
+        # Hämta transaktioner
+        cur.execute(SQL_LIST_TRANSACTIONS, (id,))
+
+        return Response(orjson.dumps([
+            {
+                "id": tid,
+                "type": trans_type,
+                "amount": round(amount, 2),
+                "description": description,
+                "createdAt": ms_to_iso(created_at),
+            }
+            for tid, trans_type, amount, description, created_at in cur
+        ]), media_type="application/json")
+
+# ---------- FRONTEND (static/) ----------
+def load_static():
+    """Läs in static/ i minnet en gång: {sökväg: (bytes, gzip-bytes|None, mimetyp, etag)}"""
+    files = {}
+    for path in STATIC_DIR.rglob("*"):
+        if not path.is_file():
+            continue
+        blob = path.read_bytes()
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        # Svag ETag: gzip-kopian och originalet delar samma tagg
+        etag = f'W/"{hashlib.sha1(blob).hexdigest()[:16]}"'
+        gz = None
+        if media_type.startswith(("text/", "application/javascript", "application/json", "image/svg+xml")):
+            gz = gzip.compress(blob, mtime=0)
+            if len(gz) >= len(blob):
+                gz = None
+        files[path.relative_to(STATIC_DIR).as_posix()] = (blob, gz, media_type, etag)
+    app.state.static = files
+
+@app.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def static_file(path: str, request: Request):
+    if path == "" or path.endswith("/"):
+        path += "index.html"
+    entry = app.state.static.get(path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    blob, gz, media_type, etag = entry
+
+    # Filerna har inga hashade namn, så HTML revalideras alltid och övrigt cachas ett dygn
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache" if media_type == "text/html" else "public, max-age=86400",
+    }
+    if gz is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if gz is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        blob = gz
+    return Response(content=blob, media_type=media_type, headers=headers)
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Azure App Service startup command: sh startup.sh
+# (Configuration > General settings > Startup Command)
+#
+# uvloop + httptools come with uvicorn[standard] in requirements.txt.
+# One worker on purpose: the friends-list ETag version and response cache live
+# in process memory, and SQLite only has one writer anyway.
+exec uvicorn main:app \
+    --host 0.0.0.0 \
+    --port "${PORT:-8000}" \
+    --loop uvloop \
+    --http httptools \
+    --workers 1